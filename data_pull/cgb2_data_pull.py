@@ -9,10 +9,31 @@ import matplotlib.pyplot as plt
 from matplotlib import pylab, style
 import numpy as np
 import datetime
+import os
 import pickle
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from result_cache import (default_cache, file_fingerprint, frame_token,
+                          source_fingerprint)
 
 style.use('bmh')
 
+CGB2_PATH = r'O:\Plant\CGB2.xls'
+SYSPRO_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                               os.pardir, 'syspro_data')
+BATCH_PICKLE_PATH = 'batch_prod_df.pickle'
+
+# Comps tracked in the batch matrix and BOM (see comp_df_defs).
+COMP_LIST = ['3077', '3001', '3004', '1968', '1651', '2004', '6105', '2073',
+             '1661', '6101', '2290', '3036']
+
+# The comp each CGB2 sheet holds. None: the comp of each batch is listed in
+# the sheet's 'F' column.
+CGB2_SHEET_COMPS = {'3077': '3077',
+                    'milled Russian': 'milled_russian',
+                    'CG mixes-Orig': None}
+
 
 class CGBBatchProduced:
     def __init__(self, comp=None):
@@ -154,6 +175,17 @@ def prod_time(num_batches, comp, find_lot=7.5, pull_mat=2.75,
     return major_prod_time/60, minor_prod_time/60
 
 
+def add_syspro_data_path():
+    """
+    Puts the syspro_data directory on sys.path, so that data_pull modules can
+    import RM_lot_tracker.
+    """
+    if SYSPRO_DATA_DIR not in sys.path:
+        sys.path.append(SYSPRO_DATA_DIR)
+
+
+@default_cache.cached(file_fingerprint(CGB2_PATH),
+                      source_fingerprint(CGBBatchProduced))
 def all_comp_batches_made_df(start_date, end_date):
     """
     Builds a DataFrame matrix, indexed by date, showing each comp usage by
@@ -167,14 +199,299 @@ def all_comp_batches_made_df(start_date, end_date):
     :return: (dataframe) lists batches produced by date of each comp.
     """
     build_df = pd.DataFrame(index=pd.date_range(start_date, end_date))
-    comp_list = ['3077', '3001', '3004', '1968', '1651', '2004', '6105',
-                 '2073', '1661', '6101', '2290', '3036']
-    for comp in comp_list:
+    for comp in COMP_LIST:
         build_df[comp] = CGBBatchProduced(comp).batches_made_by_date(
             start_date, end_date)
     return build_df
 
 
+def _cell_str(value):
+    """
+    Formats an Excel cell as a string, dropping the '.0' Excel adds to whole
+    numbers.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _parse_cgb2_sheet(xls, workbook, sheet):
+    """
+    Parses one CGB2 sheet into the unified batch table format.
+    :param xls: (ExcelFile) the opened workbook.
+    :param workbook: (str) path to the workbook (live or archived copy).
+    :param sheet: (str) sheet name, as listed in CGB2_SHEET_COMPS.
+    :return: (dataframe) [Workbook, Sheet, Comp, Batch_No, Date, Seq].
+    Empty if the workbook doesn't have the sheet.
+    """
+    columns = ['Workbook', 'Sheet', 'Comp', 'Batch_No', 'Date', 'Seq']
+    if sheet not in xls.sheet_names:
+        return pd.DataFrame(columns=columns)
+    excel_df = xls.parse(sheet)
+
+    # Sheets name their batch column 'Batch_No' or 'Batch_No.'.
+    batch_cols = [col for col in excel_df.columns
+                  if str(col).strip().rstrip('.') == 'Batch_No']
+    if not batch_cols:
+        raise ValueError('No batch column in sheet {0} of {1}'.format(
+            sheet, workbook))
+    excel_df = excel_df[excel_df[batch_cols[0]].notnull()]
+
+    batch_df = pd.DataFrame({'Workbook': workbook, 'Sheet': sheet},
+                            index=excel_df.index)
+    if CGB2_SHEET_COMPS.get(sheet) is None:
+        batch_df['Comp'] = excel_df['F'].map(_cell_str)
+        # As in get_comp_list, only 4-digit comps are real; this drops blank
+        # and note cells in the 'F' column.
+        batch_df = batch_df[batch_df['Comp'].str.len() == 4]
+    else:
+        batch_df['Comp'] = CGB2_SHEET_COMPS[sheet]
+    batch_df['Batch_No'] = excel_df[batch_cols[0]].map(_cell_str)
+
+    # As in batches_made_by_date, only 8-digit batch numbers (YYMMDD + 2
+    # digit sequence within the day) with a valid date are kept.
+    batch_df = batch_df[batch_df['Batch_No'].str.len() == 8]
+    batch_df = batch_df.assign(
+        Date=pd.to_datetime('20' + batch_df['Batch_No'].str[0:6],
+                            format='%Y%m%d', errors='coerce'),
+        Seq=pd.to_numeric(batch_df['Batch_No'].str[6:8],
+                          errors='coerce').fillna(0).astype(int))
+    return batch_df[batch_df['Date'].notnull()][columns]
+
+
+def _parse_cgb2_workbook(workbook, sheets):
+    """
+    Parses sheets of one CGB2 workbook into the unified batch table format.
+    The workbook is read once for all its sheets. Run in a worker process by
+    ingest_cgb2_workbooks.
+    :param workbook: (str) path to a CGB2 workbook.
+    :param sheets: (list) sheet names, as listed in CGB2_SHEET_COMPS.
+    :return: (list) one dataframe per sheet, as from _parse_cgb2_sheet.
+    """
+    with pd.ExcelFile(workbook) as xls:
+        return [_parse_cgb2_sheet(xls, workbook, sheet) for sheet in sheets]
+
+
+def ingest_cgb2_workbooks(workbooks=(CGB2_PATH,), sheets=None,
+                          max_workers=None):
+    """
+    Parses sheets of several CGB2 workbooks (e.g. the live workbook and its
+    archived copies from earlier years) concurrently in a process pool, and
+    combines them into one batch table. A batch found in more than one
+    workbook is only counted once.
+    Each workbook is one task, which reads the workbook once and parses its
+    sheets in turn. Workbooks are parsed in parallel, sheets aren't: the
+    default single-workbook call parses its sheets serially in one worker,
+    and only passing archived copies as well spreads the work.
+    NOTE: Must be called from under an "if __name__ == '__main__':" guard on
+    Windows, as it starts worker processes.
+    :param workbooks: (list) paths to CGB2 workbooks. Default: CGB2_PATH.
+    :param sheets: (list) sheet names to parse. Default: every sheet in
+    CGB2_SHEET_COMPS.
+    :param max_workers: (int) worker processes. Default: one per core.
+    :return: (dataframe) [Workbook, Sheet, Comp, Batch_No, Date, Seq],
+    sorted by date.
+    """
+    if sheets is None:
+        sheets = list(CGB2_SHEET_COMPS)
+    with ProcessPoolExecutor(max_workers) as pool:
+        sheet_dfs = [sheet_df for workbook_dfs in pool.map(
+            _parse_cgb2_workbook, workbooks, [sheets] * len(workbooks))
+            for sheet_df in workbook_dfs]
+    batch_table = pd.concat(sheet_dfs, ignore_index=True)
+    batch_table['Date'] = pd.to_datetime(batch_table['Date'])
+    batch_table['Seq'] = batch_table['Seq'].astype(int)
+
+    # Archived copies overlap the live workbook. Count the n-th listing of a
+    # batch number in a sheet once, however many workbooks list it.
+    batch_table['_listing'] = batch_table.groupby(
+        ['Workbook', 'Sheet', 'Comp', 'Batch_No']).cumcount()
+    batch_table = batch_table.drop_duplicates(
+        ['Sheet', 'Comp', 'Batch_No', '_listing'])
+    return batch_table.drop('_listing', axis=1).sort_values(
+        ['Date', 'Batch_No'], kind='mergesort').reset_index(drop=True)
+
+
+def batch_table_matrix(batch_table, start_date, end_date, comp_list=None):
+    """
+    Builds the batches produced by date matrix (as all_comp_batches_made_df
+    does) from a batch table made by ingest_cgb2_workbooks, without
+    re-parsing CGB2.
+    :param batch_table: (dataframe) batch table from ingest_cgb2_workbooks.
+    :param start_date: (str) Date, formatted as (dd/mm/yyyy), indicates the
+    start date for the matrix.
+    :param end_date: (str) Date, formatted as (dd/mm/yyyy), indicates the
+    end date for the matrix. Batches made on the end date are not counted.
+    :param comp_list: (list) comps to include. Default: every comp in the
+    table.
+    :return: (dataframe) lists batches produced by date of each comp.
+    """
+    start_date = pd.to_datetime(start_date)
+    end_date = pd.to_datetime(end_date)
+    if comp_list is None:
+        comp_list = sorted(batch_table['Comp'].unique())
+    in_range = batch_table[(batch_table['Date'] >= start_date) &
+                           (batch_table['Date'] < end_date)]
+    return pd.crosstab(in_range['Date'], in_range['Comp']).reindex(
+        index=pd.date_range(start_date, end_date), columns=comp_list,
+        fill_value=0).rename_axis(None).rename_axis(None, axis=1).astype(float)
+
+
+class ShiftBatchMatrix:
+    """
+    Batches produced at the finest resolution CGB2 supports: the sequence
+    number of the batch within its day (the last two digits of the batch
+    number). Held as compact arrays sorted by day and sequence, and
+    resampled to shifts, days, weeks or custom windows on demand, without
+    re-parsing CGB2.
+    """
+
+    def __init__(self, batch_table, shift_seq_starts=()):
+        """
+        :param batch_table: (dataframe) batch table from
+        ingest_cgb2_workbooks.
+        :param shift_seq_starts: (tuple of int) the batch sequence numbers at
+        which the 2nd, 3rd, ... shift of the day start. e.g. (5, 9): batches
+        1-4 are made on 1st shift, 5-8 on 2nd shift, 9 on up on 3rd shift.
+        Shifts split the day evenly. Default: one shift per day.
+        """
+        days = batch_table['Date'].values.astype(
+            'datetime64[D]').astype(np.int64)
+        seqs = batch_table['Seq'].values.astype(np.int64)
+        self._comps = sorted(batch_table['Comp'].unique())
+        comp_codes = pd.Categorical(batch_table['Comp'],
+                                    categories=self._comps).codes
+
+        order = np.lexsort((comp_codes, seqs, days))
+        self._days = days[order].astype(np.int32)
+        self._seqs = seqs[order].astype(np.int16)
+        self._comp_codes = comp_codes[order].astype(np.int16)
+
+        # Shift slots count shifts from 1/1/1970: day * shifts + shift.
+        self._shift_seq_starts = np.asarray(shift_seq_starts, dtype=np.int64)
+        self._num_shifts = len(self._shift_seq_starts) + 1
+        self._slots = (self._days.astype(np.int64) * self._num_shifts +
+                       np.searchsorted(self._shift_seq_starts, self._seqs,
+                                       side='right'))
+        self._cum_comps = None
+
+    @classmethod
+    def from_cgb2(cls, workbooks=(CGB2_PATH,), shift_seq_starts=(),
+                  **ingest_kwargs):
+        """
+        Builds the matrix from CGB2 workbooks, via ingest_cgb2_workbooks.
+        """
+        return cls(ingest_cgb2_workbooks(workbooks, **ingest_kwargs),
+                   shift_seq_starts)
+
+    @property
+    def comps(self):
+        return list(self._comps)
+
+    @property
+    def shift_hours(self):
+        return 24.0 / self._num_shifts
+
+    def _cumulative_comps(self):
+        """
+        Running count of batches of each comp, in sorted order, with a
+        leading zero row. Built on first use.
+        """
+        if self._cum_comps is None:
+            cum_comps = np.zeros((len(self._comp_codes) + 1, len(self._comps)),
+                                 dtype=np.int32)
+            cum_comps[np.arange(1, len(self._comp_codes) + 1),
+                      self._comp_codes] = 1
+            self._cum_comps = np.cumsum(cum_comps, axis=0, out=cum_comps)
+        return self._cum_comps
+
+    def sequence_counts(self):
+        """
+        Returns the batches of each comp at full resolution.
+        :return: (dataframe) indexed by (Date, Seq), one column per comp.
+        Only sequence numbers with batches are listed.
+        """
+        seq_df = pd.crosstab(
+            [self._days.astype('datetime64[D]'), self._seqs],
+            pd.Categorical.from_codes(self._comp_codes, self._comps))
+        return seq_df.reindex(columns=self._comps, fill_value=0).rename_axis(
+            ['Date', 'Seq']).rename_axis(None, axis=1)
+
+    def resample(self, freq='D', start=None, end=None):
+        """
+        Returns batches produced of each comp per shift, day, week, etc. As in
+        all_comp_batches_made_df, batches from start up to (not including)
+        end are counted, over an index running through end.
+        :param freq: (str) 'shift', or a pandas offset alias ('D', 'W', '2W',
+        'MS', ...). Default: 'D'
+        :param start: (str) Date, formatted as (dd/mm/yyyy). Default: date of
+        the first batch (required if there are no batches).
+        :param end: (str) Date, formatted as (dd/mm/yyyy). Default: today.
+        :return: (dataframe) batches of each comp, indexed by the start time
+        of each shift/day/period (e.g. the Sunday starting each 'W' week).
+        Shift and day frames can be passed to
+        batch_current_future_time_analysis.
+        """
+        if start is None:
+            if not len(self._days):
+                raise ValueError('No batches to take a start date from; '
+                                 'pass start.')
+            start_day = int(self._days[0])
+        else:
+            start_day = int(pd.to_datetime(start).to_datetime64().astype(
+                'datetime64[D]').astype(np.int64))
+        if end is None:
+            end = datetime.date.today()
+        end_day = int(pd.to_datetime(end).to_datetime64().astype(
+            'datetime64[D]').astype(np.int64))
+        if end_day < start_day:
+            raise ValueError('end ({0}) is before start ({1})'.format(
+                np.datetime64(end_day, 'D'), np.datetime64(start_day, 'D')))
+        num_days = end_day - start_day + 1
+        low, high = np.searchsorted(self._days, [start_day, end_day])
+        start_date = pd.Timestamp(np.datetime64(start_day, 'D'))
+
+        if freq == 'shift':
+            bins = self._slots[low:high] - start_day * self._num_shifts
+            num_bins = num_days * self._num_shifts
+            index = start_date + pd.to_timedelta(
+                np.arange(num_bins) * self.shift_hours, unit='h')
+        else:
+            bins = self._days[low:high].astype(np.int64) - start_day
+            num_bins = num_days
+            index = pd.date_range(start_date, periods=num_days)
+
+        num_comps = len(self._comps)
+        counts = np.bincount(bins * num_comps + self._comp_codes[low:high],
+                             minlength=num_bins * num_comps)
+        batch_df = pd.DataFrame(
+            counts.reshape(num_bins, num_comps).astype(float),
+            index=index, columns=self._comps)
+        if freq not in ('shift', 'D'):
+            batch_df = batch_df.resample(freq, label='left',
+                                         closed='left').sum()
+        return batch_df
+
+    def window_counts(self, edges):
+        """
+        Returns batches produced of each comp in custom windows. Each window
+        runs from one edge up to (not including) the next, and counts the
+        shifts starting within it.
+        :param edges: (list) window edges as dates or timestamps, in order.
+        :return: (dataframe) indexed by window start, one column per comp.
+        """
+        edges = pd.to_datetime(pd.Index(edges))
+        shift_length = pd.Timedelta(hours=self.shift_hours)
+        edge_slots = np.ceil(
+            np.asarray((edges - pd.Timestamp(0)) / shift_length,
+                       dtype=float)).astype(np.int64)
+        positions = np.searchsorted(self._slots, edge_slots)
+        cum_comps = self._cumulative_comps()
+        counts = cum_comps[positions[1:]] - cum_comps[positions[:-1]]
+        return pd.DataFrame(counts.astype(float), index=edges[:-1],
+                            columns=self._comps)
+
+
 def current_state_batch_example():
     """
     An example dataframe used to model our current preweigh process operation.
@@ -286,17 +603,33 @@ def batch_current_future_time_analysis(batch_df):
     plt.show()
 
 
-def week_batches_prod(week=2):
+def _load_batch_matrix(path=BATCH_PICKLE_PATH):
+    """
+    Loads the pickled batch matrix (as built by all_comp_batches_made_df).
+    Reads BATCH_PICKLE_PATH by default, the file the result cache
+    fingerprints.
+    :param path: (str) pickle to load. Default: BATCH_PICKLE_PATH
+    :return: (dataframe) batches produced by date of each comp.
+    """
+    with open(path, 'rb') as pickle_in:
+        return pickle.load(pickle_in)
+
+
+def week_batches_prod(week=2, batches_df=None):
     """
     Builds a dataframe showing the number of batches produced by rolling weeks.
     By default, displays a rolling 2-week period, but can be changed to be any
-    number of weeks (between 1 and 48).
+    number of weeks (between 1 and 47).
     :param week: (int) number of rolling weeks used to build dataframe.
+    :param batches_df: (dataframe) batches produced by date of each comp, as
+    built by all_comp_batches_made_df. Default: loaded from
+    batch_prod_df.pickle.
     :return: (dataframe) batches produced by x weeks.
     """
+    if batches_df is None:
+        batches_df = _load_batch_matrix()
+
     def batches_used(composition, start, end):
-        pickle_in = open('batch_prod_df.pickle', 'rb')
-        batches_df = pickle.load(pickle_in)
         batch_per_day = batches_df[composition][start:end]
         total_batches = batch_per_day.sum()
         return total_batches
@@ -308,10 +641,7 @@ def week_batches_prod(week=2):
     week_use_df['end_date'] = week_use_df['start_date'].shift(-week)
     week_use_df.dropna(inplace=True)
 
-    comp_list = ['3077', '3001', '3004', '1968', '1651', '2004', '6105',
-                 '2073', '1661', '6101', '1651', '2290', '3036']
-
-    for comp in comp_list:
+    for comp in COMP_LIST:
         temp_list = []
         for idx in range(period_num - week):
             temp_list.append(batches_used(comp, week_use_df['start_date'][idx],
@@ -480,7 +810,36 @@ def comp_df_defs(comp=None):
         return df_dict[comp]
 
 
-def mat_use_by_x_week(stockcode, num_weeks=2):
+def _bom_fingerprint(arguments):
+    """
+    Result cache fingerprint of the comp definitions in comp_df_defs.
+    """
+    return [(comp, frame_token(comp_df))
+            for comp, comp_df in sorted(comp_df_defs().items())]
+
+
+def bom_matrix_df(comp_list=None):
+    """
+    Builds the BOM matrix from comp_df_defs: the lbs of each stockcode needed
+    per batch of each comp (0 if not required). As in mat_use_by_x_week, the
+    first listing of a stockcode in a comp is the one used.
+    :param comp_list: (list) comps to include. Default: COMP_LIST.
+    :return: (dataframe) indexed by comp, with a (float) column per
+    stockcode, in order of first appearance.
+    """
+    if comp_list is None:
+        comp_list = COMP_LIST
+    merged_comps = pd.concat([comp_df_defs(comp).assign(Comp=comp)
+                              for comp in comp_list])
+    merged_comps = merged_comps.drop_duplicates(['Comp', 'StockCode'])
+    merged_comps['lbs'] = merged_comps['lbs'].astype(float)
+    unique_sc = merged_comps['StockCode'].unique()
+    return merged_comps.pivot(
+        index='Comp', columns='StockCode', values='lbs').reindex(
+        index=comp_list, columns=unique_sc).fillna(0)
+
+
+def mat_use_by_x_week(stockcode, num_weeks=2, batches_df=None, bom_df=None):
     """
     Evaluates material usage based on a CGB-Pull system. Multiplies the amount
     of material of (stockcode) needed for a comp (0 if not requiered) and
@@ -489,45 +848,51 @@ def mat_use_by_x_week(stockcode, num_weeks=2):
     matrix.
     :param num_weeks: (int) the rolling-week structure, as used above to build
     the batch produced dataframe.
+    :param batches_df: (dataframe) batches produced by date of each comp.
+    Default: loaded from batch_prod_df.pickle.
+    :param bom_df: (dataframe) BOM matrix, as built by bom_matrix_df.
+    Default: built from comp_df_defs.
     :return: (dataframe) amount of the given material used per comp per
     rolling-weeks.
     """
-    batches_x_week = week_batches_prod(num_weeks)
+    if bom_df is None:
+        bom_df = bom_matrix_df()
+    batches_x_week = week_batches_prod(num_weeks, batches_df)
     comp_list = list(batches_x_week.columns.values)[2:]
     mat_use_df = pd.DataFrame()
     mat_use_df['start_date'] = batches_x_week['start_date']
     mat_use_df['end_date'] = batches_x_week['end_date']
 
     for comp in comp_list:
-        try:
-            comp_df = comp_df_defs(comp)
-            comp_weight = float(comp_df[
-                comp_df['StockCode'] == stockcode]['lbs'].iloc[0])
-        except IndexError:
+        if stockcode in bom_df.columns:
+            comp_weight = bom_df.at[comp, stockcode]
+        else:
             comp_weight = 0
         mat_use_df[comp] = batches_x_week[comp] * comp_weight
-    mat_use_df['sum'] = mat_use_df.sum(axis=1)
+    mat_use_df['sum'] = mat_use_df[comp_list].sum(axis=1)
     return mat_use_df
 
 
-def material_usage_statistics(weeks):
+@default_cache.cached(file_fingerprint(BATCH_PICKLE_PATH), _bom_fingerprint,
+                      source_fingerprint(week_batches_prod, bom_matrix_df,
+                                         mat_use_by_x_week))
+def material_usage_statistics(weeks, batches_df=None):
     """
     Compiles all unique stockcodes in the comps evaluated, then applies the
     stockcodes to the mat_use_by_x_week function. A dataframe is then built,
     which maps each stock code with it's median, mean and max usage applied to
     a dataframe.
     :param weeks: (int) # of rolling weeks used to evaluate.
+    :param batches_df: (dataframe) batches produced by date of each comp.
+    Default: loaded once from batch_prod_df.pickle.
     :return: (dataframe):(str)(pk) all unique stock codes, (str) material name,
     (float) median usage in year, (float) mean usage in year, (max) max usage
     in year.
     """
-    merged_comps = pd.concat([comp_df_defs('3077'), comp_df_defs('3001'),
-                              comp_df_defs('3004'), comp_df_defs('1968'),
-                              comp_df_defs('1651'), comp_df_defs('2004'),
-                              comp_df_defs('6105'), comp_df_defs('2073'),
-                              comp_df_defs('1661'), comp_df_defs('6101'),
-                              comp_df_defs('2290'), comp_df_defs('3036')])
+    merged_comps = pd.concat([comp_df_defs(comp) for comp in COMP_LIST])
     unique_sc = merged_comps['StockCode'].unique()
+    if batches_df is None:
+        batches_df = _load_batch_matrix()
     stockcode_list = []
     mat_name_list = []
     median_list = []
@@ -539,7 +904,8 @@ def material_usage_statistics(weeks):
                     ['Material'].iloc[0])
         mat_name_list.append(mat_name)
 
-        mat_usage = mat_use_by_x_week(stockcode, num_weeks=weeks)['sum']
+        mat_usage = mat_use_by_x_week(stockcode, num_weeks=weeks,
+                                      batches_df=batches_df)['sum']
         median_usage = round(mat_usage.median(), 1)
         median_list.append(median_usage)
 
@@ -556,6 +922,89 @@ def material_usage_statistics(weeks):
     mat_stats_df['Max_Usage'] = max_list
     return mat_stats_df
 
+
+def material_usage_sweep(weeks_range=range(1, 13), batches_df=None,
+                         excel_path=None):
+    """
+    Runs material_usage_statistics for a range of rolling-week lengths in a
+    single pass. Every window sum is taken from one cumulative sum of the
+    batch matrix, using the same rolling-week windows as week_batches_prod.
+    :param weeks_range: (iterable of int) rolling-week lengths to evaluate
+    (each between 1 and 47). Default: 1 to 12 weeks.
+    :param batches_df: (dataframe) batches produced by date of each comp.
+    Default: loaded from batch_prod_df.pickle.
+    :param excel_path: (str) Optional. If given, the cube is also written to
+    this workbook, one sheet per week length ('1Week', '2Week', ...).
+    :return: (dataframe) indexed by (StockCode, Material), with a (Weeks,
+    Statistic) column for each week length and Median_Usage, Mean_Usage and
+    Max_Usage statistic. cube[2] matches material_usage_statistics(2).
+    """
+    comp_list = COMP_LIST
+    period_num = 48
+    weeks_list = list(weeks_range)
+    for weeks in weeks_list:
+        if not 1 <= weeks < period_num:
+            raise ValueError('weeks must be between 1 and {0}: {1}'.format(
+                period_num - 1, weeks))
+
+    if batches_df is None:
+        batches_df = _load_batch_matrix()
+
+    bom_df = bom_matrix_df(comp_list)
+    unique_sc = bom_df.columns.values
+    bom_matrix = bom_df.values
+    mat_names = pd.concat([comp_df_defs(comp) for comp in comp_list]
+                          ).drop_duplicates('StockCode').set_index(
+        'StockCode')['Material']
+
+    # Cumulative batches, with a leading zero row so any window sum is the
+    # difference of two rows.
+    batch_matrix = batches_df[comp_list].fillna(0).values
+    cum_batches = np.vstack([np.zeros((1, len(comp_list))),
+                             np.cumsum(batch_matrix, axis=0)])
+
+    # week_batches_prod slices [start_date:end_date], which includes both
+    # ends. Locate those bounds for every week start once.
+    week_starts = pd.date_range('12/28/2014', periods=period_num, freq='W')
+    start_pos = batches_df.index.searchsorted(week_starts, side='left')
+    end_pos = batches_df.index.searchsorted(week_starts, side='right')
+
+    # Window i of length w runs from week_starts[i] to week_starts[i + w].
+    # Windows running past the last week start are masked out.
+    weeks_arr = np.array(weeks_list)[:, np.newaxis]
+    window_idx = np.arange(period_num)[np.newaxis, :]
+    end_idx = window_idx + weeks_arr
+    valid = end_idx < period_num
+    end_idx = np.where(valid, end_idx, period_num - 1)
+    window_batches = (cum_batches[end_pos[end_idx]] -
+                      cum_batches[start_pos[window_idx]])
+
+    # (weeks, window, comp) x (comp, stockcode) -> (weeks, window, stockcode)
+    window_usage = np.dot(window_batches, bom_matrix)
+    window_usage[~valid] = np.nan
+
+    stat_names = ['Median_Usage', 'Mean_Usage', 'Max_Usage']
+    stats = np.stack([np.nanmedian(window_usage, axis=1),
+                      np.nanmean(window_usage, axis=1),
+                      np.nanmax(window_usage, axis=1)], axis=2)
+    # (weeks, stockcode, statistic) -> rows of stockcodes
+    cube_values = stats.transpose(1, 0, 2).reshape(len(unique_sc), -1)
+
+    cube = pd.DataFrame(
+        np.round(cube_values, 1),
+        index=pd.MultiIndex.from_arrays(
+            [unique_sc, mat_names[unique_sc].values],
+            names=['StockCode', 'Material']),
+        columns=pd.MultiIndex.from_product(
+            [weeks_list, stat_names], names=['Weeks', 'Statistic']))
+
+    if excel_path is not None:
+        with pd.ExcelWriter(excel_path) as writer:
+            for weeks in weeks_list:
+                cube[weeks].reset_index(level='Material').to_excel(
+                    writer, sheet_name='{0}Week'.format(weeks))
+    return cube
+
 # wk_1_stats = pickle.load(open('1_wk_rm_stats_rev_1.pickle', 'rb'))
 # wk_2_stats = pickle.load(open('2_wk_rm_stats_rev_1.pickle', 'rb'))
 #
@@ -567,4 +1016,5 @@ def material_usage_statistics(weeks):
 # wk_2_stats.to_excel(writer, '2week')
 # writer.save()
 
-print(material_usage_statistics(1))
\ No newline at end of file
+if __name__ == '__main__':
+    print(material_usage_statistics(1))
\ No newline at end of file
@@ -0,0 +1,140 @@
+"""
+Plant-wide lot depletion calendar. Joins projected material demand from the
+batch matrix and BOM (cgb2_data_pull) with the open lots of every stockcode
+in SYSPRO (RM_lot_tracker), drawing lots down in FIFO order.
+"""
+
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from cgb2_data_pull import (_load_batch_matrix, add_syspro_data_path,
+                            bom_matrix_df)
+from result_cache import default_cache, source_fingerprint
+
+add_syspro_data_path()
+from RM_lot_tracker import MaterialAnalyzer
+
+
+def _lot_watermark(arguments):
+    """
+    Result cache fingerprint of a stockcode's LotTransactions.
+    """
+    return arguments['analyzer'].transactions_watermark()
+
+
+@default_cache.cached(_lot_watermark, source_fingerprint(MaterialAnalyzer))
+def stockcode_open_lots(analyzer, min_usage_year=2006):
+    """
+    Cached MaterialAnalyzer.open_lots, recomputed only when the stockcode's
+    lot transactions change. The analyzer's connection serves both the
+    watermark and the lots query.
+    """
+    return analyzer.open_lots(min_usage_year)
+
+
+def open_lots_df(stockcodes=None, server='ZIRSYSPRO', db='ZIRPROD',
+                 min_usage_year=2006):
+    """
+    Collects the open lots of several stockcodes into one dataframe.
+    :param stockcodes: (list) stockcodes to pull. Default: every stockcode in
+    the BOM.
+    :param server: (str) SYSPRO SQL server.
+    :param db: (str) SYSPRO database.
+    :param min_usage_year: (int) only lots with transactions in or after this
+    year are considered.
+    :return: (dataframe) [StockCode, LotJob, ReceiptDate, QuantityOriginal,
+    QuantityRemaining]
+    """
+    if stockcodes is None:
+        stockcodes = list(bom_matrix_df().columns)
+    lot_dfs = []
+    for stockcode in stockcodes:
+        analyzer = MaterialAnalyzer(stockcode, server, db)
+        lots_df = stockcode_open_lots(analyzer, min_usage_year).copy()
+        lots_df.insert(0, 'StockCode', stockcode)
+        lot_dfs.append(lots_df)
+    return pd.concat(lot_dfs, ignore_index=True)
+
+
+def lot_depletion_forecast(lots_df, batches_df=None, history_days=90,
+                           planned_df=None, start=None, horizon_days=365):
+    """
+    Projects the depletion date of every open lot, across all stockcodes in
+    one pass. Daily demand for each stockcode is projected from the batch
+    matrix x BOM; each stockcode's lots are consumed oldest receipt first,
+    and a lot is depleted on the first day cumulative demand covers it and
+    every lot received before it.
+    :param lots_df: (dataframe) open lots, as returned by open_lots_df.
+    :param batches_df: (dataframe) batches produced by date of each comp.
+    Default: loaded from batch_prod_df.pickle.
+    :param history_days: (int) number of trailing days of batches_df
+    averaged to project daily batches of each comp. Default: 90
+    :param planned_df: (dataframe) Optional. Planned batches by date of each
+    comp (formatted as current_state_batch_example). Used in place of the
+    trailing average on the dates it covers.
+    :param start: (str) Date the forecast starts. Default: today.
+    :param horizon_days: (int) number of days projected. Lots outlasting the
+    horizon get no depletion date. Default: 365
+    :return: (dataframe) lots_df with DepletionDate and DaysToDepletion
+    columns, sorted by DepletionDate.
+    """
+    if batches_df is None:
+        batches_df = _load_batch_matrix()
+    if start is None:
+        start_date = pd.to_datetime(datetime.date.today())
+    else:
+        start_date = pd.to_datetime(start)
+    forecast_dates = pd.date_range(start_date, periods=horizon_days)
+
+    bom_df = bom_matrix_df()
+    bom_df = bom_df[bom_df.index.isin(batches_df.columns)]
+    comp_list = list(bom_df.index)
+
+    # Projected batches of each comp on each forecast date.
+    daily_batches = batches_df[comp_list].fillna(0).iloc[-history_days:].mean()
+    batch_plan = pd.DataFrame(
+        np.tile(daily_batches.values, (horizon_days, 1)),
+        index=forecast_dates, columns=comp_list)
+    if planned_df is not None:
+        planned = planned_df.reindex(columns=comp_list).fillna(0)
+        planned = planned[planned.index.isin(forecast_dates)]
+        batch_plan.loc[planned.index] = planned.values
+
+    # (date, comp) x (comp, stockcode) -> cumulative lbs of each stockcode
+    # demanded by the end of each date.
+    cum_demand = np.cumsum(np.dot(batch_plan.values, bom_df.values), axis=0)
+
+    # FIFO: a lot runs out once demand reaches the quantity remaining in it
+    # plus every older lot of the same stockcode.
+    forecast_df = lots_df.sort_values(['StockCode', 'ReceiptDate']).copy()
+    sc_idx = bom_df.columns.get_indexer(forecast_df['StockCode'])
+    in_bom = sc_idx >= 0
+    cum_lots = forecast_df.groupby('StockCode')[
+        'QuantityRemaining'].cumsum().values.astype(float)
+
+    # Lay every stockcode's cumulative demand end to end in one sorted array,
+    # each offset past the end of the one before, so a single searchsorted
+    # finds every lot's depletion day. Quantities beyond the horizon's demand
+    # are capped so they land at the end of their own stockcode's block.
+    demand_max = cum_demand[-1]
+    offsets = np.concatenate([[0], np.cumsum(demand_max + 1)[:-1]])
+    flat_demand = (cum_demand.T + offsets[:, np.newaxis]).ravel()
+    lot_sc = sc_idx[in_bom]
+    targets = (offsets[lot_sc] +
+               np.minimum(cum_lots[in_bom], demand_max[lot_sc] + 0.5))
+    depletion_day = (np.searchsorted(flat_demand, targets, side='left') -
+                     lot_sc * horizon_days)
+
+    days_to_depletion = np.full(len(forecast_df), np.nan)
+    days_to_depletion[in_bom] = np.where(depletion_day < horizon_days,
+                                         depletion_day, np.nan)
+    forecast_df['DaysToDepletion'] = days_to_depletion
+    forecast_df['DepletionDate'] = start_date + pd.to_timedelta(
+        forecast_df['DaysToDepletion'], unit='D')
+    return forecast_df.sort_values(['DepletionDate', 'StockCode'])
+
+
+if __name__ == '__main__':
+    print(lot_depletion_forecast(open_lots_df()))
@@ -0,0 +1,477 @@
+"""
+Small local asyncio HTTP/JSON service for preweigh dashboard queries.
+Loads the batch matrix, BOM and lot data once and keeps them warm in memory,
+refreshing in the background when CGB2, the batch matrix pickle or the
+SYSPRO lot transactions change.
+
+Run from the data_pull directory:
+    python preweigh_service.py --port 8050
+Then query, e.g.:
+    /batches_made_by_date?comp=3001&start=1/1/2015&end=6/1/2015
+    /week_batches_prod?week=2
+    /mat_use_by_x_week?stockcode=00550225&weeks=2
+    /lots?stockcode=00550225
+    /lot/days_total?stockcode=00550225&lot=12345
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import math
+import os
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+import pandas as pd
+
+from cgb2_data_pull import (BATCH_PICKLE_PATH, CGB2_PATH, _load_batch_matrix,
+                            add_syspro_data_path, all_comp_batches_made_df,
+                            bom_matrix_df, mat_use_by_x_week,
+                            week_batches_prod)
+
+add_syspro_data_path()
+from RM_lot_tracker import MaterialAnalyzer
+
+
+class QueryError(Exception):
+    """
+    Raised for a bad query (missing or invalid parameters). Reported to the
+    client as a 400 response.
+    """
+
+
+# Rolling week lengths week_batches_prod can build (its 48 weekly periods
+# leave no windows for longer lengths).
+MAX_WEEKS = 47
+
+
+class PreweighDataStore:
+    """
+    Holds the batch matrix, BOM and lot data in memory, and answers the
+    dashboard queries from them. All methods are blocking; the service runs
+    them in executors.
+    """
+
+    def __init__(self, batch_pickle=BATCH_PICKLE_PATH, workbook=CGB2_PATH,
+                 history_start='1/1/2015', server='ZIRSYSPRO', db='ZIRPROD'):
+        self._batch_pickle = batch_pickle
+        self._workbook = workbook
+        self._history_start = history_start
+        self._server = server
+        self._db = db
+
+        # (batch matrix, BOM matrix, query results) swapped in as one tuple
+        # on every reload. Queries take the tuple once, so a result computed
+        # from one matrix is never stored alongside another.
+        self._warm = (None, None, {})
+        self._stamps = {}
+        self._loaded_at = None
+
+        # Lot data, keyed by stockcode. Each stockcode's results are dropped
+        # when its LotTransactions watermark moves. Only touched on the SQL
+        # thread; status reads the swapped-in tuple of stockcodes instead.
+        self._analyzers = {}
+        self._warm_stockcodes = ()
+        self._watermarks = {}
+        self._lot_cache = {}
+
+    @staticmethod
+    def _stamp(path):
+        """
+        Returns (mtime, size) of a file, or None if it can't be reached.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def load(self):
+        """
+        Loads the batch matrix and BOM. The matrix is read from the pickle if
+        one exists, otherwise built from CGB2.
+        """
+        stamps = {self._batch_pickle: self._stamp(self._batch_pickle),
+                  self._workbook: self._stamp(self._workbook)}
+        pickle_stamp = stamps[self._batch_pickle]
+        workbook_stamp = stamps[self._workbook]
+        # Fall back to CGB2 when there's no pickle, or it predates the
+        # workbook.
+        if pickle_stamp is not None and (workbook_stamp is None or
+                                         workbook_stamp[0] <= pickle_stamp[0]):
+            batches_df = _load_batch_matrix(self._batch_pickle)
+        else:
+            batches_df = all_comp_batches_made_df(self._history_start,
+                                                  datetime.date.today())
+        self._install(batches_df, stamps)
+
+    def _install(self, batches_df, stamps):
+        self._warm = (batches_df, bom_matrix_df(), {})
+        self._stamps = stamps
+        self._loaded_at = datetime.datetime.now()
+
+    def refresh_batches(self):
+        """
+        Reloads the batch matrix if its sources changed since the last load.
+        A changed pickle is reloaded; a changed CGB2 workbook is re-parsed.
+        :return: (bool) True if the matrix was reloaded.
+        """
+        old_pickle = self._stamps.get(self._batch_pickle)
+        old_workbook = self._stamps.get(self._workbook)
+        new_pickle = self._stamp(self._batch_pickle)
+        new_workbook = self._stamp(self._workbook)
+        stamps = {self._batch_pickle: new_pickle,
+                  self._workbook: new_workbook}
+
+        if new_workbook is not None and new_workbook != old_workbook:
+            batches_df = all_comp_batches_made_df(self._history_start,
+                                                  datetime.date.today())
+        elif new_pickle is not None and new_pickle != old_pickle:
+            batches_df = _load_batch_matrix(self._batch_pickle)
+        else:
+            return False
+        self._install(batches_df, stamps)
+        return True
+
+    def refresh_lots(self):
+        """
+        Checks the LotTransactions watermark of every stockcode queried so
+        far, and drops the cached lot results of those that moved.
+        :return: (list) stockcodes whose lot data was dropped.
+        """
+        stale = []
+        for stockcode, analyzer in list(self._analyzers.items()):
+            watermark = analyzer.transactions_watermark()
+            if watermark != self._watermarks.get(stockcode):
+                self._watermarks[stockcode] = watermark
+                self._lot_cache[stockcode] = {}
+                stale.append(stockcode)
+        return stale
+
+    def status(self):
+        """
+        Returns a dict describing what's loaded.
+        """
+        batches_df, _, query_cache = self._warm
+        return {'loaded_at': self._loaded_at,
+                'batch_dates': [batches_df.index.min(),
+                                batches_df.index.max()],
+                'comps': list(batches_df.columns),
+                'sources': {path: stamp is not None
+                            for path, stamp in self._stamps.items()},
+                'cached_queries': len(query_cache),
+                'stockcodes_warm': list(self._warm_stockcodes)}
+
+    def comps(self):
+        """
+        Returns the comps available in the batch matrix.
+        """
+        return list(self._warm[0].columns)
+
+    def batches_made_by_date(self, comp, start=None, end=None):
+        """
+        Mirrors CGBBatchProduced.batches_made_by_date, answered from the warm
+        batch matrix. Dates outside the matrix are refused rather than
+        reported as zero batches.
+        :param start: (str) Default: first date of the matrix.
+        :param end: (str) Default: the day after the last date of the matrix.
+        """
+        batches_df = self._warm[0]
+        if comp not in batches_df.columns:
+            raise QueryError('unknown comp: {0}'.format(comp))
+        first_date = batches_df.index.min()
+        last_date = batches_df.index.max()
+        if start is None:
+            start_date = first_date
+        else:
+            start_date = pd.to_datetime(start)
+        if end is None:
+            end_date = last_date + pd.Timedelta(days=1)
+        else:
+            end_date = pd.to_datetime(end)
+        if start_date < first_date or end_date > last_date + pd.Timedelta(
+                days=1):
+            raise QueryError(
+                'batch matrix only covers {0:%m/%d/%Y} to {1:%m/%d/%Y}'.format(
+                    first_date, last_date))
+        comp_s = batches_df[comp]
+        comp_s = comp_s[(comp_s.index >= start_date) &
+                        (comp_s.index < end_date)]
+        return comp_s.reindex(pd.date_range(start_date, end_date),
+                              fill_value=0)
+
+    @staticmethod
+    def _check_weeks(weeks):
+        if not 1 <= weeks <= MAX_WEEKS:
+            raise QueryError('weeks must be between 1 and {0}: {1}'.format(
+                MAX_WEEKS, weeks))
+
+    def week_batches_prod(self, week=2):
+        """
+        Mirrors week_batches_prod, answered from the warm batch matrix.
+        """
+        self._check_weeks(week)
+        batches_df, _, query_cache = self._warm
+        key = ('week_batches_prod', week)
+        if key not in query_cache:
+            query_cache[key] = week_batches_prod(week, batches_df)
+        return query_cache[key]
+
+    def mat_use_by_x_week(self, stockcode, num_weeks=2):
+        """
+        Mirrors mat_use_by_x_week, answered from the warm batch matrix.
+        """
+        self._check_weeks(num_weeks)
+        batches_df, bom_df, query_cache = self._warm
+        key = ('mat_use_by_x_week', stockcode, num_weeks)
+        if key not in query_cache:
+            query_cache[key] = mat_use_by_x_week(stockcode, num_weeks,
+                                                 batches_df, bom_df)
+        return query_cache[key]
+
+    def _analyzer(self, stockcode):
+        if stockcode not in self._analyzers:
+            analyzer = MaterialAnalyzer(stockcode, self._server, self._db)
+            self._watermarks[stockcode] = analyzer.transactions_watermark()
+            self._lot_cache[stockcode] = {}
+            self._analyzers[stockcode] = analyzer
+            self._warm_stockcodes = tuple(sorted(self._analyzers))
+        return self._analyzers[stockcode]
+
+    def lot_query(self, stockcode, method, *args):
+        """
+        Calls a MaterialAnalyzer method for a stockcode, returning the warm
+        result if the stockcode's lot transactions haven't moved since it was
+        computed.
+        :param stockcode: (str) Material stockcode.
+        :param method: (str) MaterialAnalyzer method name, e.g. 'days_total'.
+        :param args: arguments passed to the method.
+        """
+        analyzer = self._analyzer(stockcode)
+        lot_cache = self._lot_cache[stockcode]
+        key = (method,) + args
+        if key not in lot_cache:
+            lot_cache[key] = getattr(analyzer, method)(*args)
+        return lot_cache[key]
+
+    def lot_method_query(self, stockcode, method, lot, *args):
+        """
+        As lot_query, for a MaterialAnalyzer method analyzing one lot. Lots
+        without transactions for the stockcode are refused, as the methods
+        can't analyze them.
+        :param lot: (str) lot of the stockcode.
+        """
+        if self.lot_query(stockcode, 'lot_transactions', lot).empty:
+            raise QueryError('no transactions for lot {0} of {1}'.format(
+                lot, stockcode))
+        return self.lot_query(stockcode, method, lot, *args)
+
+
+def _clean(obj):
+    """
+    Converts query results to JSON-serializable values. NaN becomes null, and
+    dates become ISO strings.
+    """
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return json.loads(obj.to_json(orient='split', date_format='iso'))
+    if isinstance(obj, dict):
+        return {str(key): _clean(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_clean(value) for value in obj]
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, np.generic):
+        obj = obj.item()
+    if isinstance(obj, datetime.date):
+        return obj.isoformat()
+    if isinstance(obj, float) and math.isnan(obj):
+        return None
+    return obj
+
+
+class PreweighService:
+    """
+    Asyncio HTTP/JSON front end for a PreweighDataStore. Batch matrix queries
+    and reloads run on a thread pool; SYSPRO queries run on a single thread,
+    since the pyodbc connections are not shared safely between threads.
+    """
+
+    def __init__(self, store, refresh_interval=60):
+        self._store = store
+        self._refresh_interval = refresh_interval
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+        self._sql_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1)
+        self._routes = {
+            '/status': self._status,
+            '/comps': self._comps,
+            '/batches_made_by_date': self._batches_made_by_date,
+            '/week_batches_prod': self._week_batches_prod,
+            '/mat_use_by_x_week': self._mat_use_by_x_week,
+            '/lots': self._lots,
+            '/lot/days_receipt_to_use': self._days_receipt_to_use,
+            '/lot/days_x_percent_issued': self._days_x_percent_issued,
+            '/lot/days_total': self._days_total,
+            '/lot/material_total_remain_percent': self._remain_percent,
+        }
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def _run_sql(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._sql_executor, func, *args)
+
+    @staticmethod
+    def _param(params, name, default=None, convert=str):
+        if name not in params:
+            if default is None:
+                raise QueryError('missing parameter: {0}'.format(name))
+            return default
+        try:
+            return convert(params[name][0])
+        except ValueError:
+            raise QueryError('invalid {0}: {1}'.format(name,
+                                                       params[name][0]))
+
+    # Route handlers
+    async def _status(self, params):
+        return self._store.status()
+
+    async def _comps(self, params):
+        return self._store.comps()
+
+    async def _batches_made_by_date(self, params):
+        return self._store.batches_made_by_date(
+            self._param(params, 'comp'),
+            params.get('start', [None])[0],
+            params.get('end', [None])[0])
+
+    async def _week_batches_prod(self, params):
+        return await self._run(self._store.week_batches_prod,
+                               self._param(params, 'week', 2, int))
+
+    async def _mat_use_by_x_week(self, params):
+        return await self._run(self._store.mat_use_by_x_week,
+                               self._param(params, 'stockcode'),
+                               self._param(params, 'weeks', 2, int))
+
+    async def _lots(self, params):
+        return await self._run_sql(
+            self._store.lot_query, self._param(params, 'stockcode'),
+            'lots_list', self._param(params, 'min_usage_year', 2006, int))
+
+    async def _days_receipt_to_use(self, params):
+        return await self._run_sql(
+            self._store.lot_method_query, self._param(params, 'stockcode'),
+            'days_receipt_to_use', self._param(params, 'lot'))
+
+    async def _days_x_percent_issued(self, params):
+        return await self._run_sql(
+            self._store.lot_method_query, self._param(params, 'stockcode'),
+            'days_x_percent_issued', self._param(params, 'lot'),
+            self._param(params, 'percent', convert=float))
+
+    async def _days_total(self, params):
+        return await self._run_sql(
+            self._store.lot_method_query, self._param(params, 'stockcode'),
+            'days_total', self._param(params, 'lot'),
+            self._param(params, 'tolerance', 100, float))
+
+    async def _remain_percent(self, params):
+        return await self._run_sql(
+            self._store.lot_method_query, self._param(params, 'stockcode'),
+            'material_total_remain_percent', self._param(params, 'lot'))
+
+    async def _handle(self, reader, writer):
+        """
+        Answers a single GET request on the connection, then closes it.
+        """
+        try:
+            request_line = (await reader.readline()).decode('latin-1')
+            # Skip the headers; only GET requests without a body are served.
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.split()
+            if len(parts) < 2 or parts[0] != 'GET':
+                status, result = 405, {'error': 'only GET is supported'}
+            else:
+                url = urlsplit(parts[1])
+                handler = self._routes.get(url.path)
+                if handler is None:
+                    status, result = 404, {'error': 'unknown path: ' +
+                                                    url.path,
+                                           'paths': sorted(self._routes)}
+                else:
+                    try:
+                        status = 200
+                        result = await handler(parse_qs(url.query))
+                    except (QueryError, ValueError) as err:
+                        status, result = 400, {'error': str(err)}
+                    except Exception as err:
+                        status, result = 500, {'error': repr(err)}
+            body = json.dumps(_clean(result)).encode('utf-8')
+            writer.write(('HTTP/1.1 {0} {1}\r\n'
+                          'Content-Type: application/json\r\n'
+                          'Content-Length: {2}\r\n'
+                          'Connection: close\r\n\r\n').format(
+                status, _REASONS[status], len(body)).encode('latin-1'))
+            writer.write(body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _refresh_loop(self):
+        """
+        Periodically reloads whatever changed at the source, without blocking
+        the queries being answered.
+        """
+        while True:
+            await asyncio.sleep(self._refresh_interval)
+            try:
+                if await self._run(self._store.refresh_batches):
+                    print('Batch matrix reloaded.')
+                stale = await self._run_sql(self._store.refresh_lots)
+                if stale:
+                    print('Lot data dropped for: ' + ', '.join(stale))
+            except Exception as err:
+                # Keep serving the data already loaded.
+                print('Refresh failed: {0!r}'.format(err))
+
+    async def serve(self, host='127.0.0.1', port=8050):
+        """
+        Loads the data, then serves queries until cancelled.
+        """
+        await self._run(self._store.load)
+        server = await asyncio.start_server(self._handle, host, port)
+        refresh_task = asyncio.ensure_future(self._refresh_loop())
+        print('Serving preweigh queries on http://{0}:{1}'.format(host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            refresh_task.cancel()
+            self._executor.shutdown(wait=False)
+            self._sql_executor.shutdown(wait=False)
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8050)
+    parser.add_argument('--refresh', type=float, default=60,
+                        help='seconds between source change checks')
+    parser.add_argument('--batch-pickle', default=BATCH_PICKLE_PATH)
+    parser.add_argument('--workbook', default=CGB2_PATH)
+    args = parser.parse_args()
+
+    data_store = PreweighDataStore(args.batch_pickle, args.workbook)
+    asyncio.run(PreweighService(data_store, args.refresh).serve(args.host,
+                                                                args.port))
@@ -0,0 +1,186 @@
+"""
+Constant-memory Excel report export. Sheets are streamed to the workbook one
+row at a time, from generators of row chunks, so report memory stays flat no
+matter how long the stats and lot lifecycle tables get.
+"""
+
+import datetime
+import math
+
+import numpy as np
+import pandas as pd
+import xlsxwriter
+
+from cgb2_data_pull import add_syspro_data_path
+
+add_syspro_data_path()
+from RM_lot_tracker import MaterialAnalyzer
+
+STATS_COLUMNS = ['StockCode', 'Material', 'Median_Usage', 'Mean_Usage',
+                 'Max_Usage']
+STATS_FORMATS = {'Median_Usage': '#,##0.0', 'Mean_Usage': '#,##0.0',
+                 'Max_Usage': '#,##0.0'}
+
+LIFECYCLE_COLUMNS = ['StockCode'] + MaterialAnalyzer.LIFECYCLE_COLUMNS
+LIFECYCLE_FORMATS = {'QuantityOriginal': '#,##0',
+                     'QuantityRemaining': '#,##0', 'PercentUsed': '0"%"'}
+
+
+class StreamingReport:
+    """
+    An xlsx workbook written in constant-memory mode. Each sheet is written
+    in full by add_sheet before the next one is started, and every row is
+    flushed to disk as soon as the next one begins.
+    """
+
+    def __init__(self, path):
+        """
+        :param path: (str) path of the .xlsx file to write.
+        """
+        self._workbook = xlsxwriter.Workbook(
+            path, {'constant_memory': True,
+                   'default_date_format': 'yyyy-mm-dd'})
+        self._header_format = self._workbook.add_format({'bold': True,
+                                                         'bottom': 1})
+        self._num_formats = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _num_format(self, num_format):
+        if num_format not in self._num_formats:
+            self._num_formats[num_format] = self._workbook.add_format(
+                {'num_format': num_format})
+        return self._num_formats[num_format]
+
+    @staticmethod
+    def _write(worksheet, row, col, value, cell_format):
+        """
+        Writes one cell, mapping numpy, pandas and missing values onto the
+        matching Excel cell types.
+        """
+        if isinstance(value, np.datetime64):
+            value = pd.Timestamp(value)
+        elif isinstance(value, np.generic):
+            value = value.item()
+        if (value is None or value is pd.NaT or
+                (isinstance(value, float) and math.isnan(value))):
+            worksheet.write_blank(row, col, None, cell_format)
+        elif isinstance(value, (datetime.datetime, datetime.date)):
+            worksheet.write_datetime(row, col, value, cell_format)
+        else:
+            worksheet.write(row, col, value, cell_format)
+
+    def add_sheet(self, name, columns, chunks, num_formats=None, widths=None):
+        """
+        Streams a sheet into the workbook: a bold, frozen header row, then
+        every row of every chunk, then an autofilter over the table.
+        :param name: (str) sheet name.
+        :param columns: (list) column headers.
+        :param chunks: (iterable) row chunks. Each is a dataframe holding the
+        columns, or a list of rows with values in column order.
+        :param num_formats: (dict) Excel number format by column name, e.g.
+        {'Mean_Usage': '#,##0.0'}.
+        :param widths: (dict) column width by column name. Default: 14
+        :return: (int) number of rows written, not counting the header.
+        """
+        num_formats = num_formats or {}
+        widths = widths or {}
+        worksheet = self._workbook.add_worksheet(name)
+
+        # Column layout has to be set before the first row is written.
+        cell_formats = []
+        for col, column in enumerate(columns):
+            if column in num_formats:
+                cell_format = self._num_format(num_formats[column])
+            else:
+                cell_format = None
+            cell_formats.append(cell_format)
+            worksheet.set_column(col, col, widths.get(column, 14),
+                                 cell_format)
+        worksheet.write_row(0, 0, columns, self._header_format)
+        worksheet.freeze_panes(1, 0)
+
+        row = 0
+        for chunk in chunks:
+            if isinstance(chunk, pd.DataFrame):
+                chunk = chunk[columns].itertuples(index=False)
+            for values in chunk:
+                row += 1
+                for col, value in enumerate(values):
+                    self._write(worksheet, row, col, value, cell_formats[col])
+        worksheet.autofilter(0, 0, row, len(columns) - 1)
+        return row
+
+    def close(self):
+        """
+        Finishes writing the workbook.
+        """
+        self._workbook.close()
+
+
+def usage_stats_chunks(cube, weeks):
+    """
+    Yields the statistics of one week length of a material_usage_sweep cube,
+    as a chunk with STATS_COLUMNS.
+    :param cube: (dataframe) cube returned by material_usage_sweep.
+    :param weeks: (int) week length to yield.
+    """
+    yield cube[weeks].reset_index()
+
+
+def lot_lifecycle_chunks(stockcodes, server='ZIRSYSPRO', db='ZIRPROD',
+                         min_usage_year=2006, chunk_size=500):
+    """
+    Yields the lot lifecycle rows of several stockcodes, as computed by
+    MaterialAnalyzer.lot_lifecycle_rows, with the stockcode prepended
+    (LIFECYCLE_COLUMNS). Rows are yielded as each chunk of lots is analyzed.
+    :param stockcodes: (list) stockcodes to analyze.
+    :param server: (str) SYSPRO SQL server.
+    :param db: (str) SYSPRO database.
+    :param min_usage_year: (int) only lots used in or after this year.
+    :param chunk_size: (int) lots per chunk.
+    """
+    for stockcode in stockcodes:
+        analyzer = MaterialAnalyzer(stockcode, server, db)
+        for chunk in analyzer.lot_lifecycle_rows(min_usage_year, chunk_size):
+            yield [[stockcode] + row for row in chunk]
+
+
+def write_material_report(path, cube, stockcodes=None, **lifecycle_kwargs):
+    """
+    Writes the material usage statistics (one sheet per week length, as
+    '1Week', '2Week', ...) and, optionally, a plant-wide 'Lot Lifecycle'
+    sheet, streaming every sheet to disk.
+    :param path: (str) path of the .xlsx file to write.
+    :param cube: (dataframe) cube returned by material_usage_sweep.
+    :param stockcodes: (list) Optional. stockcodes whose lot lifecycles are
+    written.
+    :param lifecycle_kwargs: passed on to lot_lifecycle_chunks.
+    :return: (dict) rows written per sheet.
+    """
+    rows_written = {}
+    with StreamingReport(path) as report:
+        for weeks in cube.columns.get_level_values('Weeks').unique():
+            sheet = '{0}Week'.format(weeks)
+            rows_written[sheet] = report.add_sheet(
+                sheet, STATS_COLUMNS, usage_stats_chunks(cube, weeks),
+                STATS_FORMATS, {'Material': 30})
+        if stockcodes is not None:
+            rows_written['Lot Lifecycle'] = report.add_sheet(
+                'Lot Lifecycle', LIFECYCLE_COLUMNS,
+                lot_lifecycle_chunks(stockcodes, **lifecycle_kwargs),
+                LIFECYCLE_FORMATS)
+    return rows_written
+
+
+if __name__ == '__main__':
+    from cgb2_data_pull import material_usage_sweep
+
+    usage_cube = material_usage_sweep(range(1, 3))
+    print(write_material_report(
+        'rm_stats_report.xlsx', usage_cube,
+        list(usage_cube.index.get_level_values('StockCode'))))
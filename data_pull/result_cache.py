@@ -0,0 +1,296 @@
+"""
+Persistent on-disk cache for expensive analysis results. Results are keyed
+on the function name and code, its arguments, and fingerprints of the data
+it reads (workbook contents, BOM, lot transaction watermarks), so a change in
+the source data or in the code changes the key and a stale result is never
+served. Least recently used results are evicted once the cache grows past
+its size cap.
+
+Usage:
+    @default_cache.cached(file_fingerprint(r'O:\\Plant\\CGB2.xls'),
+                          source_fingerprint(CGBBatchProduced))
+    def all_comp_batches_made_df(start_date, end_date):
+        ...
+"""
+
+import functools
+import hashlib
+import inspect
+import marshal
+import os
+import pickle
+import tempfile
+import time
+
+import pandas as pd
+
+
+def frame_token(frame):
+    """
+    Returns a hash of a dataframe's or series' index, columns and values.
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(frame, index=True).values)
+    if isinstance(frame, pd.DataFrame):
+        digest.update(repr(list(frame.columns)).encode('utf-8'))
+    else:
+        digest.update(repr(frame.name).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _token(value):
+    """
+    Returns a stable string standing for an argument value in a cache key.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return frame_token(value)
+    if isinstance(value, dict):
+        return repr(sorted((repr(k), _token(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return repr([_token(v) for v in value])
+    return repr(value)
+
+
+def code_token(obj):
+    """
+    Returns a hash of a function's or class's source code, falling back to
+    the compiled bytecode when the source can't be read.
+    """
+    try:
+        code = inspect.getsource(obj).encode('utf-8')
+    except (OSError, TypeError):
+        code = marshal.dumps(obj.__code__)
+    return hashlib.sha256(code).hexdigest()
+
+
+def source_fingerprint(*objs):
+    """
+    Builds a fingerprint of the code of the functions and classes a cached
+    function calls into, for use with ResultCache.cached. The cached
+    function's own code is always part of its key; this covers its
+    dependencies.
+    :param objs: (functions, classes) code the cached result depends on.
+    :return: (function) fingerprint, called with the cached call's arguments.
+    """
+    tokens = [(obj.__module__ + '.' + obj.__qualname__, code_token(obj))
+              for obj in objs]
+
+    def fingerprint(arguments):
+        return tokens
+    return fingerprint
+
+
+def file_fingerprint(path, mtime_slack=2.0):
+    """
+    Builds a fingerprint of a source file, for use with ResultCache.cached.
+    The contents are hashed, and the hash reused until the file's mtime or
+    size changes. A hash taken within mtime_slack seconds of the file's
+    mtime is not reused: on shares with coarse mtimes (e.g. O:), a same-size
+    save moments later could keep the same mtime. The file is re-hashed on
+    every call until its mtime is older than that. Clock skew between this
+    machine and the file server beyond mtime_slack defeats the check. A
+    missing file fingerprints as None.
+    :param path: (str) file to fingerprint.
+    :param mtime_slack: (float) seconds of mtime resolution (and clock skew)
+    to allow for. Default: 2.0
+    :return: (function) fingerprint, called with the cached call's arguments.
+    """
+    known = {}
+
+    def fingerprint(arguments):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        stamp = (stat.st_mtime, stat.st_size)
+        if known.get('stamp') != stamp or not known['settled']:
+            hashed_at = time.time()
+            digest = hashlib.sha256()
+            with open(path, 'rb') as source:
+                for block in iter(lambda: source.read(1 << 20), b''):
+                    digest.update(block)
+            known['stamp'] = stamp
+            known['hash'] = digest.hexdigest()
+            # Any later save gets a later mtime only if this one was already
+            # past the mtime resolution when the file was read.
+            known['settled'] = stat.st_mtime < hashed_at - mtime_slack
+        return path, known['hash']
+    return fingerprint
+
+
+class ResultCache:
+    """
+    A directory of pickled results, one file per key. A file's mtime is its
+    last use, which drives the LRU eviction. Hit, miss and eviction counts
+    are kept for the life of the object.
+    """
+
+    def __init__(self, cache_dir='result_cache', max_bytes=500 * 2 ** 20):
+        """
+        :param cache_dir: (str) directory the results are stored in.
+        Created on first write.
+        :param max_bytes: (int) size cap of the cache directory, in bytes.
+        Default: 500 MB
+        """
+        self._cache_dir = cache_dir
+        self._max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self._cache_dir, key + '.pickle')
+
+    def _entries(self):
+        """
+        Returns [(last_used, size, path)] of every stored result.
+        """
+        entries = []
+        try:
+            names = os.listdir(self._cache_dir)
+        except OSError:
+            return entries
+        for name in names:
+            if name.endswith('.pickle'):
+                path = os.path.join(self._cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    @staticmethod
+    def make_key(name, arguments, fingerprints):
+        """
+        Hashes a function name, its bound arguments and the fingerprint
+        values into a cache key.
+        """
+        digest = hashlib.sha256()
+        digest.update(name.encode('utf-8'))
+        for arg_name, value in arguments.items():
+            digest.update(arg_name.encode('utf-8'))
+            digest.update(_token(value).encode('utf-8'))
+        for value in fingerprints:
+            digest.update(_token(value).encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Returns (True, result) if the key is stored, otherwise (False, None).
+        A stored result that can't be loaded (e.g. pickled under another
+        pandas version) counts as a miss, and is removed.
+        """
+        path = self._path(key)
+        try:
+            pickle_in = open(path, 'rb')
+        except OSError:
+            self.misses += 1
+            return False, None
+        try:
+            with pickle_in:
+                result = pickle.load(pickle_in)
+        except Exception:
+            self.misses += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return False, None
+        # Mark as recently used, unless it was just evicted.
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return True, result
+
+    def put(self, key, result):
+        """
+        Stores a result, then evicts the least recently used results until
+        the cache is back under its size cap.
+        """
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # Write to a temp file and move it in place, so a crash never leaves
+        # a truncated result behind.
+        handle, temp_path = tempfile.mkstemp(dir=self._cache_dir,
+                                             suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as pickle_out:
+                pickle.dump(result, pickle_out, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self._path(key))
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        self._evict(keep=self._path(key))
+
+    def _evict(self, keep=None):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self._max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes every stored result.
+        """
+        for _, _, path in self._entries():
+            os.remove(path)
+
+    def stats(self):
+        """
+        Returns a dict of hits, misses, evictions, hit rate, stored entries
+        and bytes used.
+        """
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else None,
+                'entries': len(entries),
+                'bytes': sum(size for _, size, _ in entries)}
+
+    def cached(self, *fingerprints, version=None):
+        """
+        Decorator caching a function's results in this cache. The function's
+        source code is part of the key, so editing it retires its old
+        results.
+        :param fingerprints: (functions) each is called with a dict of the
+        call's arguments (defaults applied), and returns a value that
+        changes whenever the data the function reads changes.
+        :param version: Optional. Bump to retire old results by hand, e.g.
+        after a change in code the fingerprints don't cover.
+        """
+        def decorator(func):
+            signature = inspect.signature(func)
+            name = func.__module__ + '.' + func.__qualname__
+            code = (code_token(func), version)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = bound.arguments
+                key = self.make_key(name, arguments,
+                                    [code] + [fingerprint(arguments)
+                                              for fingerprint in fingerprints])
+                found, result = self.get(key)
+                if not found:
+                    result = func(*args, **kwargs)
+                    self.put(key, result)
+                return result
+            wrapper.cache = self
+            return wrapper
+        return decorator
+
+
+default_cache = ResultCache()
@@ -0,0 +1,65 @@
+"""
+Checks the FIFO depletion days found by lot_depletion_forecast on a small
+hand-worked fixture.
+"""
+
+import sys
+import types
+
+import numpy as np
+import pandas as pd
+import pytest
+
+try:
+    import pyodbc  # noqa: F401
+except ImportError:
+    # No ODBC driver here (e.g. libodbc missing). These tests never reach SQL
+    # Server, so a placeholder module is enough to import RM_lot_tracker.
+    pyodbc = types.ModuleType('pyodbc')
+    pyodbc.connect = None
+    sys.modules['pyodbc'] = pyodbc
+pytest.importorskip('matplotlib')
+from cgb2_data_pull import COMP_LIST
+from lot_depletion_forecast import lot_depletion_forecast
+
+# Two batches of 3001 a day, nothing else: 80 lbs/day of Mag Chem 10 -325
+# (00550225) and 1040 lbs/day of A-Grain for 3001 (000792).
+BATCHES = pd.DataFrame(0.0, index=pd.date_range('10/1/2015', '12/31/2015'),
+                       columns=COMP_LIST)
+BATCHES['3001'] = 2.0
+
+LOTS = pd.DataFrame(
+    [('00550225', 'NEWER', pd.Timestamp('2015-12-01'), 300),
+     ('00550225', 'OLDER', pd.Timestamp('2015-11-01'), 100),
+     ('000792', 'BIG', pd.Timestamp('2015-11-01'), 20000),
+     ('000954', 'IDLE', pd.Timestamp('2015-11-01'), 50),
+     ('99999999', 'NOBOM', pd.Timestamp('2015-11-01'), 50)],
+    columns=['StockCode', 'LotJob', 'ReceiptDate', 'QuantityRemaining'])
+
+
+def _days(forecast_df):
+    return forecast_df.set_index('LotJob')['DaysToDepletion']
+
+
+def test_fifo_depletion_days():
+    days = _days(lot_depletion_forecast(LOTS, BATCHES, start='1/1/2016',
+                                        horizon_days=10))
+    # Older lot first: 100 lbs by day 1; then 400 lbs cumulative by day 4.
+    assert days['OLDER'] == 1
+    assert days['NEWER'] == 4
+    # Outlasts the horizon, no demand, and not in the BOM.
+    assert np.isnan(days['BIG'])
+    assert np.isnan(days['IDLE'])
+    assert np.isnan(days['NOBOM'])
+
+
+def test_planned_batches_override_trailing_average():
+    planned = pd.DataFrame(0.0, index=pd.date_range('1/1/2016', periods=3),
+                           columns=['3001'])
+    forecast_df = lot_depletion_forecast(LOTS, BATCHES, planned_df=planned,
+                                         start='1/1/2016', horizon_days=10)
+    days = _days(forecast_df)
+    assert days['OLDER'] == 4
+    assert days['NEWER'] == 7
+    assert forecast_df.set_index('LotJob').at['OLDER', 'DepletionDate'] == (
+        pd.Timestamp('2016-01-05'))
@@ -10,6 +10,12 @@ class MaterialAnalyzer:
     the stockcode in a number of ways.
     """
 
+    # Columns of the rows yielded by lot_lifecycle_rows.
+    LIFECYCLE_COLUMNS = ['LotJob', 'ReceiptDate', 'FirstIssueDate',
+                         'DaysReceiptToUse', 'LastUseDate', 'DaysUse',
+                         'DaysTotal', 'QuantityOriginal', 'QuantityRemaining',
+                         'PercentUsed']
+
     def __init__(self, stockcode: str, server: str='ZIRSYSPRO',
                  db: str ='ZIRPROD') -> object:
         """
@@ -23,6 +29,10 @@ class MaterialAnalyzer:
                                     self._server + ';DATABASE=' + self._db +
                                     ';Trusted_Connection=yes')
 
+    def __repr__(self):
+        return 'MaterialAnalyzer({0!r}, server={1!r}, db={2!r})'.format(
+            self._stockcode, self._server, self._db)
+
     def lots_list(self, min_usage_year = 2006):
         """
         Returns a list of unique lots for a given stock code.
@@ -38,6 +48,22 @@ class MaterialAnalyzer:
         unique_lots = unique_df['LotJob'].unique().tolist()
         return unique_lots
 
+    def transactions_watermark(self):
+        """
+        Returns the date of the latest transaction and the number of
+        transactions logged for the object stock code, as a tuple. The
+        watermark changes whenever a lot of the stock code is received, issued
+        or adjusted.
+        """
+        sql = """
+            SELECT MAX(TrnDate) as LastTrnDate, COUNT(*) as NumTrns
+              FROM [ZIRPROD].[dbo].[LotTransactions]
+              where StockCode = '{0}'
+            """.format(self._stockcode)
+        mark_df = pd.read_sql(sql, self._conn)
+        return (str(mark_df['LastTrnDate'].iloc[0]),
+                int(mark_df['NumTrns'].iloc[0]))
+
     def lot_transactions(self, lot):
         """
         Takes in a lot as an argument, and returns the receipt and issuances of
@@ -76,7 +102,7 @@ class MaterialAnalyzer:
             # to have the issuance be positive. The following elif accounts for
             # this by looking at the first issuance and assigning a 1 or -1
             # multiplier if the issuance is negative or positive, respectively.
-            elif first_issuance and usage_df['TrnType'].iget_value(i) == 'I':
+            elif first_issuance and usage_df['TrnType'].iloc[i] == 'I':
                 if value > 0:
                     issuance_style = -1
                 else:
@@ -86,8 +112,8 @@ class MaterialAnalyzer:
                 first_issuance = False
                 i += 1
             # Adjustments are applied as-is                
-            elif (usage_df['TrnType'].iget_value(i) == 'A' or
-                  usage_df['TrnType'].iget_value(i) == 'R'):
+            elif (usage_df['TrnType'].iloc[i] == 'A' or
+                  usage_df['TrnType'].iloc[i] == 'R'):
                 usage_value = usage_list[-1] + value
                 usage_list.append(usage_value)
                 i += 1
@@ -120,15 +146,15 @@ class MaterialAnalyzer:
         days.
         """
         lot_trns = self.lot_transactions(lot)
-        date_receipt = lot_trns['TrnDate'].iget_value(0)
+        date_receipt = lot_trns['TrnDate'].iloc[0]
         lot_usage_days = self.trns_usage_df(lot)['FloatTrnDate']
 
         i = 0
         for trntype in lot_trns['TrnType'].tolist():
             if trntype == 'I':
-                days = (lot_usage_days.iget_value(i) -
-                        lot_usage_days.iget_value(0))
-                date_first_issue = lot_trns['TrnDate'].iget_value(i)
+                days = (lot_usage_days.iloc[i] -
+                        lot_usage_days.iloc[0])
+                date_first_issue = lot_trns['TrnDate'].iloc[i]
                 i += 1
                 return [date_receipt, date_first_issue, int(days)]
             elif trntype != 'I':
@@ -151,15 +177,15 @@ class MaterialAnalyzer:
         if date_first_issue is np.nan:
             return [np.nan, np.nan, np.nan]
         else:
-            starting_quantity = lot_usage.iget_value(0)
+            starting_quantity = lot_usage.iloc[0]
             i = 0
             for value in lot_usage.tolist():
                 if value > starting_quantity * (1 - percent / 100):
                     i += 1
                 else:
-                    date_x_issue = lot_usage_dates.iget_value(i)
-                    days = (lot_usage_days.iget_value(i) -
-                            lot_usage_days.iget_value(0) - days_first_issue)
+                    date_x_issue = lot_usage_dates.iloc[i]
+                    days = (lot_usage_days.iloc[i] -
+                            lot_usage_days.iloc[0] - days_first_issue)
                     return [date_first_issue, date_x_issue, int(days)]
             return [date_first_issue, np.nan, np.nan]
 
@@ -176,21 +202,21 @@ class MaterialAnalyzer:
         lot_usage_dates = self.trns_usage_df(lot)['TrnDate']
         # variable to go to the end of the dataframe
         table_len = len(lot_usage_dates.tolist()) - 1
-        date_receipt = lot_usage_dates.iget_value(0)
-        date_last_use = lot_usage_dates.iget_value(table_len)
+        date_receipt = lot_usage_dates.iloc[0]
+        date_last_use = lot_usage_dates.iloc[table_len]
 
         # days variables and calculation
         lot_usage_days = self.trns_usage_df(lot)['FloatTrnDate']
-        today = self.lot_transactions(lot)['today'].iget_value(0)
+        today = self.lot_transactions(lot)['today'].iloc[0]
 
-        days_use = (lot_usage_days.iget_value(table_len) -
-                    lot_usage_days.iget_value(0))
+        days_use = (lot_usage_days.iloc[table_len] -
+                    lot_usage_days.iloc[0])
         # returns total days as days use if the lot is completely consumed
         # (within the set tolerance, default: 100%)
         if self.material_total_remain_percent(lot)[2] >= tolerance:
             days_total = days_use
         else:
-            days_total = today - lot_usage_days.iget_value(0)
+            days_total = today - lot_usage_days.iloc[0]
 
         return [date_receipt, date_last_use, int(days_use), int(days_total)]
 
@@ -205,8 +231,8 @@ class MaterialAnalyzer:
         lot_usage = self.trns_usage_df(lot)['ProductUsage']
         # variable to go to the end of the dataframe
         table_len = len(lot_usage.tolist()) - 1
-        quantity_remaining = lot_usage.iget_value(table_len)
-        quantity_original = lot_usage.iget_value(0)
+        quantity_remaining = lot_usage.iloc[table_len]
+        quantity_original = lot_usage.iloc[0]
         # In case 0 material received, return nan for all values
         if quantity_original == 0:
             return [np.nan, np.nan, np.nan]
@@ -216,6 +242,154 @@ class MaterialAnalyzer:
                  quantity_original) * 100)
             return [quantity_original, quantity_remaining, percent_used]
 
+    @staticmethod
+    def _add_product_usage(trns_df):
+        """
+        Adds a ProductUsage column to transactions of whole lots, holding each
+        lot's running quantity under the same issuance rules as lot_usage.
+        """
+        quantity = trns_df['TrnQuantity'].astype(float).astype(int)
+        lot_job = trns_df['LotJob']
+
+        # The first transaction of a lot is taken as-is, as are adjustments
+        # and receipts. Issuances take the sign convention of the lot's first
+        # issuance (see lot_usage).
+        first_row = trns_df.groupby('LotJob', sort=False).cumcount() == 0
+        issue = (trns_df['TrnType'] == 'I') & ~first_row
+        first_issue = quantity[issue].groupby(lot_job[issue]).first()
+        issuance_style = pd.Series(np.where(first_issue > 0, -1, 1),
+                                   index=first_issue.index)
+        usage = quantity.where(
+            ~issue, quantity * lot_job.map(issuance_style).fillna(1))
+        return trns_df.assign(
+            ProductUsage=usage.groupby(lot_job, sort=False).cumsum())
+
+    def _lot_usage_chunks(self, min_usage_year=2006, fetch_rows=10000):
+        """
+        Generator yielding the receipts, issuances and adjustments of every
+        lot of the object stock code used in or after min_usage_year, with
+        their ProductUsage (see _add_product_usage). One query is fetched
+        fetch_rows rows at a time, and each chunk yielded holds whole lots
+        only: the last lot of a fetch is carried over to the next one. Lots
+        come in the order of lots_list, transactions by date.
+        """
+        sql = """
+            SELECT t.LotJob, t.TrnType, t.TrnDate, t.TrnQuantity,
+              convert(float, t.TrnDate) as FloatTrnDate,
+              convert(int, GETDATE()) as today, u.FirstUseDate
+              FROM [ZIRPROD].[dbo].[LotTransactions] t
+              join (SELECT LotJob, MIN(TrnDate) as FirstUseDate
+                      FROM [ZIRPROD].[dbo].[LotTransactions]
+                      where StockCode = '{0}' and YEAR(TrnDate) >= {1}
+                      group by LotJob) u on t.LotJob = u.LotJob
+              where t.StockCode = '{0}' and (t.TrnType = 'R' or
+              t.TrnType = 'I' or t.TrnType = 'A')
+              order by u.FirstUseDate, t.LotJob, t.TrnDate
+            """.format(self._stockcode, min_usage_year)
+        carried_df = None
+        for trns_df in pd.read_sql(sql, self._conn, chunksize=fetch_rows):
+            if carried_df is not None:
+                trns_df = pd.concat([carried_df, trns_df], ignore_index=True)
+            if trns_df.empty:
+                continue
+            # Rows of a lot are contiguous, so only the last lot can run on
+            # into the next fetch.
+            last_lot = trns_df['LotJob'] == trns_df['LotJob'].iloc[-1]
+            carried_df = trns_df[last_lot]
+            if not last_lot.all():
+                yield self._add_product_usage(trns_df[~last_lot])
+        if carried_df is not None and not carried_df.empty:
+            yield self._add_product_usage(carried_df)
+
+    @staticmethod
+    def _lifecycle_df(trns_df):
+        """
+        Computes the lifecycle columns (LIFECYCLE_COLUMNS) of whole lots from
+        their transactions and ProductUsage, matching days_receipt_to_use,
+        days_total and material_total_remain_percent.
+        """
+        lot_groups = trns_df.groupby('LotJob', sort=False)
+        receipt = lot_groups.head(1).set_index('LotJob')
+        last_use = lot_groups.tail(1).set_index('LotJob')
+        first_issue = trns_df[trns_df['TrnType'] == 'I'].groupby(
+            'LotJob', sort=False).head(1).set_index('LotJob').reindex(
+            receipt.index)
+
+        # In case 0 material was received, quantities are nan.
+        quantity_original = receipt['ProductUsage']
+        quantity_remaining = last_use['ProductUsage']
+        received = quantity_original != 0
+        percent_used = np.ceil(
+            (quantity_original - quantity_remaining) /
+            quantity_original * 100).where(received)
+        # Total days equal days of use once the lot is used up, otherwise
+        # they run to today.
+        days_use = np.trunc(last_use['FloatTrnDate'] -
+                            receipt['FloatTrnDate'])
+        days_total = days_use.where(
+            percent_used >= 100,
+            np.trunc(receipt['today'] - receipt['FloatTrnDate']))
+
+        return pd.DataFrame({
+            'ReceiptDate': receipt['TrnDate'],
+            'FirstIssueDate': first_issue['TrnDate'],
+            'DaysReceiptToUse': np.trunc(first_issue['FloatTrnDate'] -
+                                         receipt['FloatTrnDate']),
+            'LastUseDate': last_use['TrnDate'],
+            'DaysUse': days_use,
+            'DaysTotal': days_total,
+            'QuantityOriginal': quantity_original.where(received),
+            'QuantityRemaining': quantity_remaining.where(received),
+            'PercentUsed': percent_used}).reset_index()[
+            MaterialAnalyzer.LIFECYCLE_COLUMNS]
+
+    def lot_lifecycle_rows(self, min_usage_year=2006, chunk_size=500,
+                           fetch_rows=10000):
+        """
+        Generator yielding the lifecycle of every lot of the object stock code
+        (receipt to first use, use to depletion, quantity remaining), in
+        chunks of up to chunk_size rows. Lets plant-wide lifecycle tables be
+        written out as they're computed. Row values follow LIFECYCLE_COLUMNS,
+        and match days_receipt_to_use, days_total and
+        material_total_remain_percent.
+        Transactions come from one query, fetched fetch_rows rows at a time,
+        and lifecycles are computed a fetch of whole lots at a time, so
+        memory stays bounded by fetch_rows and chunk_size however many lots
+        the stock code has.
+        """
+        rows = []
+        for trns_df in self._lot_usage_chunks(min_usage_year, fetch_rows):
+            rows.extend(self._lifecycle_df(trns_df).values.tolist())
+            while len(rows) >= chunk_size:
+                yield rows[:chunk_size]
+                rows = rows[chunk_size:]
+        if rows:
+            yield rows
+
+    def open_lots(self, min_usage_year=2006):
+        """
+        Returns a dataframe of the lots of the object stock code which still
+        hold material, oldest receipt first. All lots are pulled in a single
+        query, and remaining quantities follow the same issuance rules as
+        lot_usage.
+        Columns: [LotJob, ReceiptDate, QuantityOriginal, QuantityRemaining]
+        """
+        lot_dfs = []
+        for trns_df in self._lot_usage_chunks(min_usage_year):
+            lot_groups = trns_df.groupby('LotJob', sort=False)
+            lots_df = pd.DataFrame({
+                'ReceiptDate': lot_groups['TrnDate'].first(),
+                'QuantityOriginal': lot_groups['ProductUsage'].first(),
+                'QuantityRemaining': lot_groups['ProductUsage'].last()})
+            lot_dfs.append(lots_df[(lots_df['QuantityOriginal'] > 0) &
+                                   (lots_df['QuantityRemaining'] > 0)])
+        if not lot_dfs:
+            return pd.DataFrame(columns=['LotJob', 'ReceiptDate',
+                                         'QuantityOriginal',
+                                         'QuantityRemaining'])
+        lots_df = pd.concat(lot_dfs)
+        lots_df.index.name = 'LotJob'
+        return lots_df.sort_values('ReceiptDate').reset_index()
 
 stockcode_list = ['00060225',
                   '000656',
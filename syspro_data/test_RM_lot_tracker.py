@@ -0,0 +1,118 @@
+"""
+Checks MaterialAnalyzer's set-based lot methods against its per-lot ones, on
+a fixture of LotTransactions rows instead of SYSPRO.
+"""
+
+import re
+import sys
+import types
+
+import pandas as pd
+import pytest
+
+try:
+    import pyodbc  # noqa: F401
+except ImportError:
+    # No ODBC driver here (e.g. libodbc missing). These tests never reach SQL
+    # Server, so a placeholder module is enough to import RM_lot_tracker.
+    pyodbc = types.ModuleType('pyodbc')
+    pyodbc.connect = None
+    sys.modules['pyodbc'] = pyodbc
+import RM_lot_tracker
+from RM_lot_tracker import MaterialAnalyzer
+
+
+def _trns(lot, rows):
+    return [(lot, trn_type, pd.Timestamp(date), quantity)
+            for trn_type, date, quantity in rows]
+
+
+# Lots covering each of the lot_usage rules.
+TRANSACTIONS = pd.DataFrame(
+    # Issuances logged negative (old procedure), with an adjustment.
+    _trns('NEG', [('R', '2014-01-02', 1000.0), ('I', '2014-01-10', -200.0),
+                  ('A', '2014-01-11', -5.0), ('I', '2014-02-01', -300.0)]) +
+    # Issuances logged positive (new procedure), with a second receipt.
+    _trns('POS', [('R', '2014-03-01 18:00', 800.0),
+                  ('I', '2014-03-04 06:00', 300.0),
+                  ('R', '2014-03-05', 50.0), ('I', '2014-03-09', 100.7)]) +
+    # First row is an issuance: taken as-is, the next issuance sets the sign.
+    _trns('FIRSTI', [('I', '2014-04-01', 500.0), ('I', '2014-04-03', 100.0),
+                     ('I', '2014-04-08', 50.0)]) +
+    # Zero first issuance keeps issuances as logged.
+    _trns('ZEROI', [('R', '2014-05-01', 300.0), ('I', '2014-05-02', 0.0),
+                    ('I', '2014-05-20', -100.0)]) +
+    # Nothing received.
+    _trns('ZERO', [('R', '2014-06-01', 0.0), ('A', '2014-06-02', 100.0)]) +
+    # Used up.
+    _trns('DONE', [('R', '2014-07-01', 500.0), ('I', '2014-07-15', 500.0)]) +
+    # Never issued.
+    _trns('NEW', [('R', '2014-08-01', 250.0)]),
+    columns=['LotJob', 'TrnType', 'TrnDate', 'TrnQuantity'])
+TRANSACTIONS['FloatTrnDate'] = (
+    (TRANSACTIONS['TrnDate'] - pd.Timestamp('1900-01-01')) /
+    pd.Timedelta(days=1))
+TRANSACTIONS['today'] = 41900
+TRANSACTIONS['FirstUseDate'] = TRANSACTIONS.groupby('LotJob')[
+    'TrnDate'].transform('min')
+
+
+@pytest.fixture
+def analyzer(monkeypatch):
+    def read_sql(sql, conn, chunksize=None):
+        lot = re.search(r"LotJob = '(\w+)'", sql)
+        if lot:
+            trns_df = TRANSACTIONS[TRANSACTIONS['LotJob'] == lot.group(1)]
+        else:
+            trns_df = TRANSACTIONS.sort_values(
+                ['FirstUseDate', 'LotJob', 'TrnDate'])
+        trns_df = trns_df.reset_index(drop=True)
+        if chunksize is None:
+            return trns_df
+        return (trns_df.iloc[start:start + chunksize]
+                for start in range(0, len(trns_df), chunksize))
+    monkeypatch.setattr(RM_lot_tracker.pyodbc, 'connect', lambda conn: None)
+    monkeypatch.setattr(pd, 'read_sql', read_sql)
+    return MaterialAnalyzer('00550225')
+
+
+def test_open_lots_matches_lot_usage(analyzer):
+    expected = {}
+    for lot in TRANSACTIONS['LotJob'].unique():
+        usage = analyzer.lot_usage(lot, series=False)
+        if usage[0] > 0 and usage[-1] > 0:
+            expected[lot] = (usage[0], usage[-1])
+
+    open_lots = analyzer.open_lots().set_index('LotJob')
+    assert set(open_lots.index) == set(expected) == {'NEG', 'POS', 'FIRSTI',
+                                                     'ZEROI', 'NEW'}
+    for lot, (original, remaining) in expected.items():
+        assert open_lots.at[lot, 'QuantityOriginal'] == original
+        assert open_lots.at[lot, 'QuantityRemaining'] == remaining
+    assert list(open_lots['ReceiptDate']) == sorted(open_lots['ReceiptDate'])
+
+
+def _same(left, right):
+    return (pd.isnull(left) and pd.isnull(right)) or left == right
+
+
+def test_lot_lifecycle_rows_match_per_lot_methods(analyzer):
+    expected = []
+    for lot in analyzer.lots_list():
+        date_receipt, date_first_issue, days_to_use = (
+            analyzer.days_receipt_to_use(lot))
+        _, date_last_use, days_use, days_total = analyzer.days_total(lot)
+        expected.append([lot, date_receipt, date_first_issue, days_to_use,
+                         date_last_use, days_use, days_total] +
+                        analyzer.material_total_remain_percent(lot))
+
+    # Fetches of 1 and 2 rows split most lots across fetches.
+    for fetch_rows in (1, 2, 3, 10000):
+        chunks = list(analyzer.lot_lifecycle_rows(chunk_size=3,
+                                                  fetch_rows=fetch_rows))
+        assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+        rows = [row for chunk in chunks for row in chunk]
+        assert [row[0] for row in rows] == [row[0] for row in expected]
+        for row, expected_row in zip(rows, expected):
+            assert all(_same(value, expected_value) for value, expected_value
+                       in zip(row, expected_row)), (row, expected_row)